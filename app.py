@@ -1,11 +1,14 @@
+import requests
 import streamlit as st
 import openai
 from streamlit_folium import st_folium
 
-from modules.route_finder import get_baseline_route, get_alternative_routes
-from modules.route_scorer import score_routes
+from modules.route_finder import get_baseline_route, get_alternative_routes, get_detour_routes
+from modules.route_scorer import attach_pois, score_routes, select_routes_to_score
+from modules.poi_enricher import POIRegistry, pois_near_route
 from modules.map_builder import create_route_map, display_route_card
-from config.settings import get_google_maps_api_key, get_openai_api_key
+from modules.utils import Deadline, DeadlineExceeded
+from config.settings import get_google_maps_api_key, get_openai_api_key, MAX_ROUTES_TO_SCORE, QUERY_DEADLINE
 
 
 st.set_page_config(page_title="Diversion", page_icon="🛤️", layout="wide")
@@ -91,8 +94,14 @@ def main():
     if st.button("Find Better Routes", type="primary") and origin and destination:
         try:
             with st.spinner("Finding interesting routes..."):
+                # Every upstream call for this query shares one time budget
+                deadline = Deadline(QUERY_DEADLINE)
+
+                # Places seen in earlier searches this session are reused by place ID
+                poi_registry = st.session_state.setdefault('poi_registry', POIRegistry())
+
                 # Get baseline route
-                baseline = get_baseline_route(google_maps_key, origin, destination, travel_mode)
+                baseline = get_baseline_route(google_maps_key, origin, destination, travel_mode, deadline)
 
                 # Get alternatives within time constraint
                 alternatives = get_alternative_routes(
@@ -103,21 +112,54 @@ def main():
                     baseline['duration'],
                     max_extra_time,
                     baseline_polyline=baseline['polyline'],
+                    deadline=deadline,
                 )
 
-                # Combine and score all routes
-                all_routes = [baseline] + alternatives
+                # Propose detours through clusters of the POIs already found
+                all_routes = attach_pois(
+                    [baseline] + alternatives, preferences, google_maps_key, deadline, poi_registry
+                )
+                # Routes passing the same place share one POI, so count it once
+                known_pois = list({
+                    poi.get('place_id') or id(poi): poi for route in all_routes for poi in route['pois']
+                }.values())
+                detours = get_detour_routes(
+                    google_maps_key,
+                    origin,
+                    destination,
+                    travel_mode,
+                    baseline['duration'],
+                    max_extra_time,
+                    known_pois,
+                    existing_polylines=[route['polyline'] for route in all_routes],
+                    baseline_distance=baseline['distance'],
+                    deadline=deadline,
+                )
+                for detour in detours:
+                    detour['pois'] = pois_near_route(known_pois, detour['polyline'])
+
+                # Alternatives and detours compete for the AI scoring slots on their POIs
+                all_routes = select_routes_to_score(all_routes + detours, preferences, MAX_ROUTES_TO_SCORE)
                 if all_routes:
-                    scored_routes = score_routes(all_routes, preferences, google_maps_key)
+                    scored_routes = score_routes(all_routes, preferences, google_maps_key, deadline, poi_registry)
                 else:
                     scored_routes = []
 
+                # Routes were left out when time ran out, so the ranking itself is partial
+                if deadline.truncated:
+                    for route in scored_routes:
+                        route['complete'] = False
+
             # Store results so they persist after reruns
             st.session_state['scored_routes'] = scored_routes
 
             if not scored_routes:
                 st.error("No suitable routes found within your time constraint.")
 
+        except (DeadlineExceeded, requests.Timeout):
+            st.error(f"Timed out finding routes - no response within {QUERY_DEADLINE} seconds.")
+            st.write("Please try again in a moment.")
+
         except Exception as e:
             st.error(f"Error finding routes: {str(e)}")
             st.write("Please check your API keys and network connection.")
@@ -125,6 +167,8 @@ def main():
     # Display existing results
     if st.session_state.get('scored_routes'):
         scored_routes = st.session_state['scored_routes']
+        if not all(route.get('complete', True) for route in scored_routes):
+            st.warning("⏱️ Ran out of time for this search - showing the best routes found so far.")
         st.subheader("Route Comparison")
         route_map = create_route_map(scored_routes)
         if route_map:
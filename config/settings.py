@@ -22,7 +22,21 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 DEFAULT_SEARCH_RADIUS = 100  # meters
 MAX_POIS_PER_ROUTE = 15
 MAX_ROUTES_TO_SCORE = 4
+POI_REGISTRY_SIZE = MAX_POIS_PER_ROUTE * MAX_ROUTES_TO_SCORE  # POIs kept for reuse per session
 DEFAULT_MAX_EXTRA_TIME = 20  # percent
+QUERY_DEADLINE = 30  # seconds per query, across all upstream calls
+
+# Detour candidate generation
+DETOUR_MIN_RATING = 4.2
+DETOUR_CLUSTER_RADIUS = 250  # meters
+DETOUR_MAX_API_CALLS = 6  # Routes API requests per query
+DETOUR_TIME_BUDGET = 8  # seconds
+DETOUR_MAX_WORKERS = 3
+DETOUR_MIN_EXTRA_TIME = 60  # seconds over the baseline
+DETOUR_MIN_EXTRA_DISTANCE = 150  # meters over the baseline
+DETOUR_MAX_OVERLAP = 0.8  # share of a detour allowed to retrace an existing route
+DETOUR_OVERLAP_TOLERANCE = 30  # meters
+MAX_DETOURS_TO_SCORE = 2
 
 # POI type mappings
 POI_TYPE_MAPPING = {
@@ -75,6 +75,8 @@ def display_route_card(route: Dict, route_number: int):
     route_type = ""
     if route['type'] == 'fastest':
         route_type = "⚡ Fastest Route"
+    elif route['type'] == 'detour':
+        route_type = f"🧭 Detour via local highlights (+{route.get('extra_time_percent', 0):.0f}% time)"
     else:
         route_type = f"🎯 Alternative (+{route.get('extra_time_percent', 0):.0f}% time)"
     
@@ -108,6 +110,7 @@ def display_route_card(route: Dict, route_number: int):
         # Technical details
         with st.expander("Technical details"):
             st.write(f"Scoring method: {route.get('scoring_method', 'unknown')}")
+            st.write(f"Results: {'complete' if route.get('complete', True) else 'partial (time limit reached)'}")
             st.write(f"Total POIs: {len(pois)}")
             if pois:
                 avg_rating = sum(poi.get('rating', 0) for poi in pois if poi.get('rating')) / len([p for p in pois if p.get('rating')])
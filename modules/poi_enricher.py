@@ -1,6 +1,141 @@
+import heapq
+import math
 import polyline
 import requests
-from typing import List, Dict, Tuple
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+from config.settings import MAX_POIS_PER_ROUTE, POI_REGISTRY_SIZE
+from .utils import Deadline, calculate_distance, request_timeout, run_with_deadline
+
+
+class POIRegistry:
+    """Least-recently-used store of canonical POIs keyed by place ID, shared across routes and queries"""
+
+    def __init__(self, max_size: int = POI_REGISTRY_SIZE):
+        self.max_size = max_size
+        self._pois: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._pois)
+
+    def get(self, place_id: str) -> Optional[Dict]:
+        poi = self._pois.get(place_id)
+        if poi is not None:
+            self._pois.move_to_end(place_id)
+        return poi
+
+    def put(self, poi: Dict):
+        self._pois[poi['place_id']] = poi
+        self._pois.move_to_end(poi['place_id'])
+        while len(self._pois) > self.max_size:
+            self._pois.popitem(last=False)
+
+
+class POIAccumulator:
+    """Merge POIs from overlapping searches by place ID, keeping only the top-rated ones"""
+
+    def __init__(self, max_pois: int = MAX_POIS_PER_ROUTE,
+                 registry: Optional[POIRegistry] = None,
+                 merge_distance: float = 30):
+        self.max_pois = max_pois
+        self.registry = registry if registry is not None else POIRegistry()
+        self.merge_distance = merge_distance
+        self._by_id: Dict[str, Dict] = {}  # place ID -> POI for results seen by this accumulator
+        self._members = set()  # id() of POIs already offered to the heap
+        self._cells: Dict[Tuple[int, int], List[Dict]] = {}  # ~100m grid for proximity matching
+        self._heap: List[Tuple[float, int, Dict]] = []  # min-heap of (rating, -arrival, poi)
+        self._arrivals = 0
+
+    @staticmethod
+    def _cell(lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat * 1000), math.floor(lng * 1000)
+
+    def _find_nearby(self, name: str, lat: float, lng: float, unkeyed_only: bool) -> Optional[Dict]:
+        """Find an accumulated POI with the same name close to the given location"""
+        cell_lat, cell_lng = self._cell(lat, lng)
+        for d_lat in (-1, 0, 1):
+            for d_lng in (-1, 0, 1):
+                for poi in self._cells.get((cell_lat + d_lat, cell_lng + d_lng), []):
+                    if unkeyed_only and poi.get('place_id'):
+                        continue
+                    location = (poi['location']['lat'], poi['location']['lng'])
+                    if poi['name'] == name and calculate_distance(location, (lat, lng)) <= self.merge_distance:
+                        return poi
+        return None
+
+    def add(self, place: Dict) -> Dict:
+        """Merge a Places API result and return the canonical POI for it"""
+        place_id = place.get('id')
+        lat = place.get('location', {}).get('latitude', 0)
+        lng = place.get('location', {}).get('longitude', 0)
+        fields = {
+            'place_id': place_id,
+            'name': place.get('displayName', {}).get('text'),
+            'rating': place.get('rating', 0),
+            'types': place.get('types', []),
+            'price_level': place.get('priceLevel', 0),
+            'location': {'lat': lat, 'lng': lng},
+            'user_ratings_total': place.get('userRatingCount', 0)
+        }
+
+        # Repeats within one accumulation come from the same round of searches,
+        # so a _by_id hit is reused as-is rather than refreshed
+        poi = self._by_id.get(place_id) if place_id else None
+        old_rating = None
+        if poi is None and place_id:
+            poi = self.registry.get(place_id)
+            if poi is not None:
+                # Refresh the shared object with the latest data for this place
+                old_rating = poi['rating']
+                poi.update(fields)
+        if poi is None:
+            # Proximity only stands in for a missing place ID; different IDs stay separate
+            poi = self._find_nearby(fields['name'], lat, lng, unkeyed_only=bool(place_id))
+            if poi is not None and place_id:
+                old_rating = poi['rating']
+                poi.update(fields)
+        if poi is None:
+            poi = fields
+        if place_id:
+            self._by_id[place_id] = poi
+
+        if id(poi) in self._members:
+            if old_rating is not None and poi['rating'] != old_rating:
+                self._rerank(poi)
+            return poi
+        self._members.add(id(poi))
+        self._cells.setdefault(self._cell(poi['location']['lat'], poi['location']['lng']), []).append(poi)
+        self._offer(poi)
+        return poi
+
+    def _offer(self, poi: Dict):
+        """Push a POI onto the bounded heap if it rates among the best so far"""
+        # Earlier arrivals win rating ties, as with a stable sort
+        self._arrivals += 1
+        entry = (poi['rating'], -self._arrivals, poi)
+        if len(self._heap) < self.max_pois:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def _rerank(self, poi: Dict):
+        """Re-key a POI whose rating changed after it was offered to the heap"""
+        for i, (_, arrival, entry_poi) in enumerate(self._heap):
+            if entry_poi is poi:
+                self._heap[i] = (poi['rating'], arrival, poi)
+                heapq.heapify(self._heap)
+                return
+        # It was evicted under its old rating, so let it compete again
+        self._offer(poi)
+
+    def top(self) -> List[Dict]:
+        """Accumulated POIs, best rated first, recording them in the registry for reuse"""
+        pois = [poi for _, _, poi in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+        for poi in pois:
+            if poi.get('place_id'):
+                self.registry.put(poi)
+        return pois
 
 
 def decode_polyline_to_points(encoded_polyline: str) -> List[Tuple[float, float]]:
@@ -18,7 +153,9 @@ def decode_polyline_to_points(encoded_polyline: str) -> List[Tuple[float, float]
 
 
 def find_pois_along_route(api_key: str, route_points: List[Tuple[float, float]], 
-                         preferences: Dict[str, int]) -> List[Dict]:
+                         preferences: Dict[str, int],
+                         deadline: Optional[Deadline] = None,
+                         registry: Optional[POIRegistry] = None) -> List[Dict]:
     """Find interesting places along the route based on user preferences"""
     
     # Map preference categories to Google Places types
@@ -50,17 +187,21 @@ def find_pois_along_route(api_key: str, route_points: List[Tuple[float, float]],
     if not poi_types:
         poi_types = ['point_of_interest']
     
-    all_pois = []
+    # A shared registry lets routes reuse POI objects for places they have in common
+    accumulator = POIAccumulator(registry=registry)
     search_radius = 100  # meters
     
     # Search around sampled points along the route
     for point in route_points[::2]:  # Sample every other point to reduce API calls
+        # Past the deadline, keep the places found so far
+        if deadline is not None and deadline.expired():
+            break
         try:
             url = "https://places.googleapis.com/v1/places:searchNearby"
             headers = {
                 "Content-Type": "application/json",
                 "X-Goog-Api-Key": api_key,
-                "X-Goog-FieldMask": "places.displayName,places.rating,places.types,places.priceLevel,places.location,places.userRatingCount"
+                "X-Goog-FieldMask": "places.id,places.displayName,places.rating,places.types,places.priceLevel,places.location,places.userRatingCount"
             }
             
             data = {
@@ -77,33 +218,33 @@ def find_pois_along_route(api_key: str, route_points: List[Tuple[float, float]],
                 }
             }
             
-            response = requests.post(url, json=data, headers=headers)
+            response = run_with_deadline(
+                deadline, requests.post, url, json=data, headers=headers, timeout=request_timeout(deadline)
+            )
             places_result = response.json()
             
             for place in places_result.get('places', []):
                 if place.get('displayName', {}).get('text') and place.get('rating', 0) > 3.0:  # Filter low-rated places
-                    poi = {
-                        'name': place.get('displayName', {}).get('text'),
-                        'rating': place.get('rating', 0),
-                        'types': place.get('types', []),
-                        'price_level': place.get('priceLevel', 0),
-                        'location': {
-                            'lat': place.get('location', {}).get('latitude', 0),
-                            'lng': place.get('location', {}).get('longitude', 0)
-                        },
-                        'user_ratings_total': place.get('userRatingCount', 0)
-                    }
-                    all_pois.append(poi)
+                    accumulator.add(place)
                     
         except Exception as e:
             continue  # Skip failed API calls
     
-    # Remove duplicates based on name and return top POIs
-    unique_pois = {}
-    for poi in all_pois:
-        if poi['name'] not in unique_pois:
-            unique_pois[poi['name']] = poi
-    
-    # Sort by rating and limit results
-    sorted_pois = sorted(unique_pois.values(), key=lambda x: x['rating'], reverse=True)
-    return sorted_pois[:15]  # Limit to top 15 to control costs
\ No newline at end of file
+    # Top POIs by rating, limited to control costs
+    return accumulator.top()
+
+
+def pois_near_route(pois: List[Dict], encoded_polyline: str, max_distance: float = 150) -> List[Dict]:
+    """Select already-fetched POIs lying within max_distance meters of a route"""
+    route_points = polyline.decode(encoded_polyline)
+    nearby = {}
+    for poi in pois:
+        # POIs found by several routes share a place ID (and usually the same object)
+        key = poi.get('place_id') or id(poi)
+        if key in nearby:
+            continue
+        location = (poi['location']['lat'], poi['location']['lng'])
+        if any(calculate_distance(location, point) <= max_distance for point in route_points):
+            nearby[key] = poi
+
+    return heapq.nlargest(MAX_POIS_PER_ROUTE, nearby.values(), key=lambda x: x['rating'])
@@ -1,9 +1,31 @@
 import requests
 import os
-from typing import List, Dict, Any, Optional
+import polyline
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Tuple
 
+from config.settings import (
+    DETOUR_CLUSTER_RADIUS,
+    DETOUR_MAX_API_CALLS,
+    DETOUR_MAX_OVERLAP,
+    DETOUR_MAX_WORKERS,
+    DETOUR_MIN_EXTRA_DISTANCE,
+    DETOUR_MIN_EXTRA_TIME,
+    DETOUR_MIN_RATING,
+    DETOUR_OVERLAP_TOLERANCE,
+    DETOUR_TIME_BUDGET,
+    MAX_DETOURS_TO_SCORE,
+)
+from .utils import Deadline, DeadlineExceeded, calculate_distance, request_timeout, run_with_deadline
 
-def get_baseline_route(api_key: str, origin: str, destination: str, mode: str) -> Dict:
+
+def get_baseline_route(
+    api_key: str,
+    origin: str,
+    destination: str,
+    mode: str,
+    deadline: Optional[Deadline] = None,
+) -> Dict:
     """Get the fastest route as baseline for comparison"""
     url = "https://routes.googleapis.com/directions/v2:computeRoutes"
     headers = {
@@ -21,7 +43,9 @@ def get_baseline_route(api_key: str, origin: str, destination: str, mode: str) -
         "computeAlternativeRoutes": False
     }
     
-    response = requests.post(url, json=data, headers=headers)
+    response = run_with_deadline(
+        deadline, requests.post, url, json=data, headers=headers, timeout=request_timeout(deadline)
+    )
     directions = response.json()
     
     if 'routes' not in directions or not directions['routes']:
@@ -50,6 +74,7 @@ def get_alternative_routes(
     baseline_duration: int,
     max_extra_percent: int,
     baseline_polyline: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
 ) -> List[Dict]:
     """Get alternative routes within time constraints."""
     url = "https://routes.googleapis.com/directions/v2:computeRoutes"
@@ -71,7 +96,15 @@ def get_alternative_routes(
         }
     }
     
-    response = requests.post(url, json=data, headers=headers)
+    # Alternatives are optional, so running out of time just means there are none
+    try:
+        response = run_with_deadline(
+            deadline, requests.post, url, json=data, headers=headers, timeout=request_timeout(deadline)
+        )
+    except (DeadlineExceeded, requests.Timeout):
+        if deadline is not None:
+            deadline.mark_truncated()
+        return []
     directions = response.json()
     
     max_duration = baseline_duration * (1 + max_extra_percent / 100)
@@ -105,3 +138,187 @@ def get_alternative_routes(
             })
 
     return viable_routes[:3]
+
+
+def cluster_pois(pois: List[Dict], radius_m: float, min_rating: float) -> List[Dict]:
+    """Group high-rated POIs into spatial clusters, strongest clusters first"""
+    clusters: List[Dict] = []
+
+    # Seed clusters from the best-rated places so each cluster is anchored on a highlight
+    candidates = sorted(
+        (poi for poi in pois if poi.get('rating', 0) >= min_rating),
+        key=lambda poi: poi.get('rating', 0),
+        reverse=True
+    )
+
+    for poi in candidates:
+        point = (poi['location']['lat'], poi['location']['lng'])
+        for cluster in clusters:
+            if calculate_distance(cluster['seed'], point) <= radius_m:
+                cluster['pois'].append(poi)
+                break
+        else:
+            clusters.append({'seed': point, 'pois': [poi]})
+
+    for cluster in clusters:
+        members = cluster['pois']
+        cluster['center'] = (
+            sum(p['location']['lat'] for p in members) / len(members),
+            sum(p['location']['lng'] for p in members) / len(members)
+        )
+        cluster['weight'] = sum(p.get('rating', 0) for p in members)
+
+    return sorted(clusters, key=lambda c: c['weight'], reverse=True)
+
+
+def _route_overlap(points: List[Tuple[float, float]], other_points: List[Tuple[float, float]]) -> float:
+    """Share of points lying within DETOUR_OVERLAP_TOLERANCE meters of another route"""
+    # A coarse sample of the candidate is enough to tell a real detour from a small jog
+    sample = points[::max(1, len(points) // 50)]
+    shared = sum(
+        1 for point in sample
+        if any(calculate_distance(point, other) <= DETOUR_OVERLAP_TOLERANCE for other in other_points)
+    )
+    return shared / len(sample)
+
+
+def _request_route_via(
+    api_key: str,
+    origin: str,
+    destination: str,
+    mode: str,
+    waypoint: Tuple[float, float],
+    timeout: float,
+) -> Optional[Dict]:
+    """Request a single route that passes through the given via waypoint"""
+    url = "https://routes.googleapis.com/directions/v2:computeRoutes"
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": api_key,
+        "X-Goog-FieldMask": "routes.duration,routes.distanceMeters,routes.polyline.encodedPolyline,routes.legs.steps"
+    }
+
+    travel_mode_map = {"driving": "DRIVE", "walking": "WALK", "cycling": "BICYCLE", "transit": "TRANSIT"}
+
+    data = {
+        "origin": {"address": origin},
+        "destination": {"address": destination},
+        "travelMode": travel_mode_map.get(mode, "DRIVE"),
+        "intermediates": [{
+            "via": True,
+            "location": {"latLng": {"latitude": waypoint[0], "longitude": waypoint[1]}}
+        }]
+    }
+
+    response = requests.post(url, json=data, headers=headers, timeout=timeout)
+    directions = response.json()
+
+    if not directions.get('routes'):
+        return None
+    return directions['routes'][0]
+
+
+def get_detour_routes(
+    api_key: str,
+    origin: str,
+    destination: str,
+    mode: str,
+    baseline_duration: int,
+    max_extra_percent: int,
+    pois: List[Dict],
+    existing_polylines: Optional[List[str]] = None,
+    baseline_distance: int = 0,
+    max_routes: int = MAX_DETOURS_TO_SCORE,
+    max_calls: int = DETOUR_MAX_API_CALLS,
+    time_budget: float = DETOUR_TIME_BUDGET,
+    max_workers: int = DETOUR_MAX_WORKERS,
+    deadline: Optional[Deadline] = None,
+) -> List[Dict]:
+    """Propose detours through clusters of highly rated POIs and keep those within time constraints"""
+    limited_by_deadline = deadline is not None and deadline.remaining() <= time_budget
+    if deadline is not None:
+        time_budget = min(time_budget, deadline.remaining())
+
+    # Via waypoints are not supported for transit directions
+    if mode == "transit" or max_calls <= 0:
+        return []
+
+    clusters = cluster_pois(pois, DETOUR_CLUSTER_RADIUS, DETOUR_MIN_RATING)[:max_calls]
+    if not clusters:
+        return []
+
+    if time_budget <= 0:
+        # The deadline left no time to try the candidates at all
+        if limited_by_deadline:
+            deadline.mark_truncated()
+        return []
+
+    # Try candidates concurrently; requests still running after the budget are
+    # abandoned and left to finish in the background
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        executor.submit(
+            _request_route_via, api_key, origin, destination, mode, cluster['center'], time_budget
+        ): cluster
+        for cluster in clusters
+    }
+    done, not_done = wait(futures, timeout=time_budget)
+    for future in not_done:
+        future.cancel()
+    executor.shutdown(wait=False)
+    if not_done and limited_by_deadline:
+        deadline.mark_truncated()
+
+    max_duration = baseline_duration * (1 + max_extra_percent / 100)
+    seen_polylines = set(existing_polylines or [])
+    known_routes = [polyline.decode(poly) for poly in seen_polylines]
+    detour_routes: List[Dict] = []
+
+    # Walk results in cluster order so detours through the strongest clusters are kept first
+    for future, cluster in futures.items():
+        if future not in done or future.exception() is not None:
+            continue
+        # The overlap check below is not free, so stop once the query is out of time
+        if deadline is not None and deadline.expired():
+            deadline.mark_truncated()
+            break
+        route = future.result()
+        if route is None:
+            continue
+
+        poly = route['polyline']['encodedPolyline']
+        if poly in seen_polylines:
+            continue
+        seen_polylines.add(poly)
+
+        duration_seconds = int(route['duration'].rstrip('s'))
+        distance_meters = route['distanceMeters']
+        if duration_seconds > max_duration:
+            continue
+        # Drop small jogs off an existing route: too little added, or mostly retraced
+        if (duration_seconds - baseline_duration < DETOUR_MIN_EXTRA_TIME
+                and distance_meters - baseline_distance < DETOUR_MIN_EXTRA_DISTANCE):
+            continue
+
+        points = polyline.decode(poly)
+        if any(_route_overlap(points, other) > DETOUR_MAX_OVERLAP for other in known_routes):
+            continue
+        known_routes.append(points)
+
+        extra_time_percent = ((duration_seconds - baseline_duration) / baseline_duration) * 100
+        detour_routes.append({
+            'duration': duration_seconds,
+            'distance': distance_meters,
+            'polyline': poly,
+            'steps': [step for leg in route.get('legs', []) for step in leg.get('steps', [])],
+            'type': 'detour',
+            'extra_time_percent': extra_time_percent,
+            'via': {'lat': cluster['center'][0], 'lng': cluster['center'][1]},
+            'duration_text': f"{duration_seconds // 60} min",
+            'distance_text': f"{distance_meters / 1000:.1f} km" if distance_meters >= 1000 else f"{distance_meters} m"
+        })
+
+        if len(detour_routes) == max_routes:
+            break
+
+    return detour_routes
@@ -1,7 +1,8 @@
 import openai
 import requests
-from typing import Dict, List, Any
-from .poi_enricher import decode_polyline_to_points, find_pois_along_route
+from typing import Dict, List, Any, Optional
+from .poi_enricher import POIRegistry, decode_polyline_to_points, find_pois_along_route
+from .utils import Deadline, request_timeout, run_with_deadline
 
 
 def calculate_heuristic_score(route: Dict, pois: List[Dict], preferences: Dict[str, int]) -> float:
@@ -43,7 +44,8 @@ def calculate_heuristic_score(route: Dict, pois: List[Dict], preferences: Dict[s
     return min(10.0, max(1.0, final_score))
 
 
-def score_with_openai(route: Dict, pois: List[Dict], preferences: Dict[str, int]) -> Dict[str, Any]:
+def score_with_openai(route: Dict, pois: List[Dict], preferences: Dict[str, int],
+                      deadline: Optional[Deadline] = None) -> Dict[str, Any]:
     """Get AI explanation and refined score"""
     if not pois:
         heuristic_score = calculate_heuristic_score(route, pois, preferences)
@@ -53,7 +55,8 @@ def score_with_openai(route: Dict, pois: List[Dict], preferences: Dict[str, int]
         return {
             'score': heuristic_score,
             'explanation': explanation,
-            'method': 'heuristic'
+            'method': 'heuristic',
+            'complete': True
         }
 
     # Build context for AI using real POIs only
@@ -81,11 +84,14 @@ Score: X/10
 Explanation: [your explanation]"""
 
     try:
-        response = openai.ChatCompletion.create(
+        response = run_with_deadline(
+            deadline,
+            openai.ChatCompletion.create,
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=150,
-            temperature=0.7
+            temperature=0.7,
+            request_timeout=request_timeout(deadline)
         )
         
         content = response.choices[0].message.content
@@ -107,11 +113,12 @@ Explanation: [your explanation]"""
         return {
             'score': ai_score,
             'explanation': explanation,
-            'method': 'ai'
+            'method': 'ai',
+            'complete': True
         }
         
     except Exception as e:
-        # Fallback to heuristic
+        # Fallback to heuristic (also used when the deadline cut the AI call short)
         heuristic_score = calculate_heuristic_score(route, pois, preferences)
         explanation = f"Route has {len(pois)} interesting places nearby."
         if route.get('extra_time_percent', 0) > 0:
@@ -120,28 +127,60 @@ Explanation: [your explanation]"""
         return {
             'score': heuristic_score,
             'explanation': explanation,
-            'method': 'heuristic'
+            'method': 'heuristic',
+            'complete': deadline is None or not deadline.expired()
         }
 
 
-def score_routes(routes: List[Dict], preferences: Dict[str, int], api_key: str) -> List[Dict]:
+def attach_pois(routes: List[Dict], preferences: Dict[str, int], api_key: str,
+                deadline: Optional[Deadline] = None,
+                registry: Optional[POIRegistry] = None) -> List[Dict]:
+    """Look up POIs for routes that don't carry them yet"""
+    # Share POI objects between routes passing the same places
+    if registry is None:
+        registry = POIRegistry()
+    for route in routes:
+        if 'pois' not in route:
+            route_points = decode_polyline_to_points(route['polyline'])
+            route['pois'] = find_pois_along_route(api_key, route_points, preferences, deadline, registry)
+            # A lookup that ran into the deadline may have skipped part of the route
+            route['complete'] = deadline is None or not deadline.expired()
+    return routes
+
+
+def select_routes_to_score(routes: List[Dict], preferences: Dict[str, int], max_routes: int) -> List[Dict]:
+    """Keep the first (baseline) route plus the most promising others by heuristic score"""
+    baseline, others = routes[:1], routes[1:]
+    others = sorted(
+        others,
+        key=lambda r: calculate_heuristic_score(r, r.get('pois', []), preferences),
+        reverse=True
+    )
+    return baseline + others[:max(0, max_routes - 1)]
+
+
+def score_routes(routes: List[Dict], preferences: Dict[str, int], api_key: str,
+                 deadline: Optional[Deadline] = None,
+                 registry: Optional[POIRegistry] = None) -> List[Dict]:
     """Score all routes and return ranked list"""
     
     scored_routes = []
     
+    # Routes that already carry POIs (e.g. detours) are not looked up again
+    attach_pois(routes, preferences, api_key, deadline, registry)
+    
     for route in routes:
-        # Get POIs along route
-        route_points = decode_polyline_to_points(route['polyline'])
-        pois = find_pois_along_route(api_key, route_points, preferences)
+        pois = route['pois']
         
         # Score the route
-        scoring_result = score_with_openai(route, pois, preferences)
+        scoring_result = score_with_openai(route, pois, preferences, deadline)
         
         # Combine everything
-        route['pois'] = pois
         route['score'] = scoring_result['score']
         route['explanation'] = scoring_result['explanation']
         route['scoring_method'] = scoring_result['method']
+        # Partial when the deadline cut either the POI lookup or the AI scoring short
+        route['complete'] = route.get('complete', True) and scoring_result['complete']
         
         scored_routes.append(route)
     
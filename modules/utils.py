@@ -1,8 +1,62 @@
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
 import math
+import time
 import googlemaps
 
 
+class DeadlineExceeded(Exception):
+    """Raised when a query runs out of time waiting on an upstream call"""
+
+    def __init__(self, message: str = "Timed out waiting for an upstream service"):
+        super().__init__(message)
+
+
+class Deadline:
+    """Wall-clock budget shared by every upstream call made for one query"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.truncated = False  # set when work was dropped because time ran out
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def mark_truncated(self):
+        """Record that results were left out because the deadline was reached"""
+        self.truncated = True
+
+
+def request_timeout(deadline: Optional[Deadline]) -> Optional[float]:
+    """Socket timeout for the next upstream call, or None when the query is unbounded"""
+    if deadline is None:
+        return None
+    if deadline.expired():
+        raise DeadlineExceeded()
+    return deadline.remaining()
+
+
+def run_with_deadline(deadline: Optional[Deadline], func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call func, giving up with DeadlineExceeded once the deadline passes"""
+    if deadline is None:
+        return func(*args, **kwargs)
+
+    # Socket timeouts only bound each connect and read, so wait on a worker thread
+    # instead; a call still running at the deadline is left to finish in the background
+    timeout = request_timeout(deadline)
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(func, *args, **kwargs)
+    executor.shutdown(wait=False)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise DeadlineExceeded()
+
+
 def calculate_distance(point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
     """Calculate distance between two lat/lng points in meters"""
     lat1, lng1 = point1